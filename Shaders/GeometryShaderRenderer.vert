@@ -1,8 +1,7 @@
 #version 330 core
 
 uniform int n_cols;
-
-layout (location = 0) in uint aTileId;
+uniform usampler2D tilemap;
 
 out VS_OUT {
     uint tileId;
@@ -11,9 +10,9 @@ out VS_OUT {
 void main()
 {
     int i = gl_VertexID;
-    float x = float(int(i % n_cols));
-    float y = float(int(i / n_cols));
-    gl_Position = vec4(x, y, 0.0, 1.0);
+    int col = i % n_cols;
+    int row = i / n_cols;
+    gl_Position = vec4(float(col), float(row), 0.0, 1.0);
     
-    vs_out.tileId = aTileId;
+    vs_out.tileId = texelFetch(tilemap, ivec2(col, row), 0).r;
 }
\ No newline at end of file
@@ -10,4 +10,6 @@ TILEMAP_N_COLS = 28
 
 WINDOW_MINIMUM_SIZE = (TILEMAP_N_COLS * TEXTURE_TILE_SIZE_PX, TILEMAP_N_ROWS * TEXTURE_TILE_SIZE_PX)
 
-SHADERS_FOLDER = './Shaders'
\ No newline at end of file
+SHADERS_FOLDER = './Shaders'
+
+VBO_RING_SIZE = 3
@@ -1,7 +1,9 @@
 import ctypes
+import functools
 import os
 from abc import ABC, abstractmethod
 
+import numpy as np
 import pyglet
 
 from src.constants import (TEXTURE_TILE_SIZE_PX,
@@ -10,17 +12,40 @@ from src.constants import (TEXTURE_TILE_SIZE_PX,
                            TEXTURE_TILE_PADDING, 
                            TILEMAP_N_ROWS, 
                            TILEMAP_N_COLS,
-                           SHADERS_FOLDER)
+                           SHADERS_FOLDER,
+                           VBO_RING_SIZE)
 
 
 
 
+@functools.lru_cache(maxsize=None)
+def _load_shader_source(filename):
+    with open(os.path.join(SHADERS_FOLDER, filename)) as f:
+        return f.read()
+
+
+def _build_texcoord_lut(n_tile_ids, dx, dy):
+    # Texcoords of the vertices of each tile id, so that updating a tile is a single lookup.
+    ids = np.arange(n_tile_ids)
+
+    # Calculate normalized texture coordinates. Use padding to mitigate the lines-between tiles bug
+    # which is caused by the lack of tile margins in the texture atlas.
+    tx0 = (ids %  TEXTURE_N_TILES_PER_ROW).astype(np.float32) * TEXTURE_TILE_SIZE_NORMALIZED + TEXTURE_TILE_PADDING
+    ty0 = (ids // TEXTURE_N_TILES_PER_ROW).astype(np.float32) * TEXTURE_TILE_SIZE_NORMALIZED + TEXTURE_TILE_PADDING
+    tSize = TEXTURE_TILE_SIZE_NORMALIZED - TEXTURE_TILE_PADDING * 2
+
+    lut = np.empty((n_tile_ids, len(dx), 2), dtype=np.float32)
+    lut[..., 0] = tx0[:, None] + dx * tSize # texcoord x
+    lut[..., 1] = ty0[:, None] + dy * tSize # texcoord y
+    return lut
 
 
 
 
 
 class _AbstractRenderer(ABC):
+    _projection_matrix = None
+
     @abstractmethod
     def __init__(self, tilemap):
         raise NotImplementedError
@@ -33,7 +58,16 @@ class _AbstractRenderer(ABC):
     def draw(self):
         raise NotImplementedError
 
+    @classmethod
+    def is_supported(cls):
+        # Renderers relying on Pyglet only need the OpenGL 3.3 context Pyglet itself requires.
+        return True
+
     def _get_projection_matrix(self):
+        # The matrix only depends on the size of the tilemap: compute it once and share it between all renderers.
+        if _AbstractRenderer._projection_matrix is not None:
+            return _AbstractRenderer._projection_matrix
+
         # Input vertex coordinates have origin on the top left with x increasing as we go right and y increasing as we go down.
         # Each tile has a width and a height of 1.
 
@@ -47,7 +81,8 @@ class _AbstractRenderer(ABC):
         # Projection matrix scales so that tilemap fits tightly into clip-space: ranging from -1 to +1 in each coordinate.
         proj_matrix  = pyglet.math.Mat4.from_scale(pyglet.math.Vec3(2 / TILEMAP_N_COLS, 2 / TILEMAP_N_ROWS, 0))
         
-        return proj_matrix @ view_matrix @ model_matrix
+        _AbstractRenderer._projection_matrix = proj_matrix @ view_matrix @ model_matrix
+        return _AbstractRenderer._projection_matrix
 
 
 
@@ -65,38 +100,72 @@ class NaiveInstantaneousRenderer(_AbstractRenderer):
             im.anchor_x = 0
             im.anchor_y = im.height        
 
-    def recalculate(self):
-        return
+        # One sprite per tile, all in the same batch: the whole tilemap is drawn with a single call
+        # instead of one blit (and draw call) per tile.
+        self._batch = pyglet.graphics.Batch()
+        # Sprites indexed as [y, x], matching the row-major layout of the tilemap.
+        self._sprites = [[pyglet.sprite.Sprite(self._image_grid[0],
+                                               x = x * TEXTURE_TILE_SIZE_PX,
+                                               y = (y + 1) * TEXTURE_TILE_SIZE_PX,
+                                               batch = self._batch)
+                          for x in range(TILEMAP_N_COLS)]
+                         for y in range(TILEMAP_N_ROWS)]
 
-    def draw(self):
+        # Revision of the tilemap when the sprites were last updated.
+        self._last_revision = None
 
-        for x in range(TILEMAP_N_COLS):
-            for y in range(TILEMAP_N_ROWS):
-                tile = self._tilemap[y, x]
-                image_tile = self._image_grid[tile]
+        self.recalculate()
+
+    def recalculate(self):
+        if self._last_revision == self._tilemap.revision:
+            return
+        self._last_revision = self._tilemap.revision
 
-                x_ = x * TEXTURE_TILE_SIZE_PX
-                y_ = (y + 1) * TEXTURE_TILE_SIZE_PX
+        for y in range(TILEMAP_N_ROWS):
+            for x in range(TILEMAP_N_COLS):
+                tile = self._tilemap[y, x]
+                self._sprites[y][x].image = self._image_grid[tile]
 
-                image_tile.blit(x_, y_, width = TEXTURE_TILE_SIZE_PX, height = TEXTURE_TILE_SIZE_PX)
+    def draw(self):
+        self._batch.draw()
 
 
 
 
 
 class _OpenGLRenderer(_AbstractRenderer, ABC):
+    # Uniforms whose location is looked up once, right after the shader program is linked.
+    _uniform_names = ('projection',)
+
+    # Linked shader programs, shared by all renderers built from the same sources.
+    _shader_programs = {}
+
+    @classmethod
+    def is_supported(cls):
+        # Direct state access and persistently mapped buffers are core since OpenGL 4.5.
+        return pyglet.gl.current_context.get_info().have_version(4, 5)
 
     def __init__(self, tilemap):
         self._tilemap = tilemap
         self._texture_id = tilemap.texture.id
 
         self._shader_handle = None
-        self._vbo_handle = None
         self._vao_handle = None
 
+        self._uniform_locations = {}
+
+        # Revision of the tilemap when its tiles were last uploaded.
+        self._last_revision = None
+
         self._create_shader()
-        self._allocate_vbo_vao()
-        self.recalculate()
+        self._set_uniforms()
+        self._allocate_vao()
+        self._allocate_buffers()
+
+        # Everything needs to be uploaded at first, whichever tiles were modified until now.
+        self._tilemap.dirty_tiles.clear()
+        self._update_tiles()
+        self._last_revision = self._tilemap.revision
 
     @abstractmethod
     def _create_shader(self):
@@ -107,15 +176,25 @@ class _OpenGLRenderer(_AbstractRenderer, ABC):
         raise NotImplementedError
 
     @abstractmethod
-    def _update_vbo(self):
+    def _allocate_buffers(self):
         raise NotImplementedError
 
     @abstractmethod
-    def _update_vao(self):
+    def _update_tiles(self, dirty_tiles=None):
         raise NotImplementedError
 
     def _compile_shader_program(self, sources_and_shadertypes):
-        self._shader_handle = pyglet.gl.glCreateProgram()
+        # Compile each program only the first time it is needed, renderers are recreated each time the user switches between them.
+        key = tuple(sources_and_shadertypes)
+        if key not in _OpenGLRenderer._shader_programs:
+            _OpenGLRenderer._shader_programs[key] = self._link_shader_program(sources_and_shadertypes)
+        self._shader_handle = _OpenGLRenderer._shader_programs[key]
+
+        self._uniform_locations = {name: pyglet.gl.glGetUniformLocation(self._shader_handle, name.encode('utf-8'))
+                                   for name in self._uniform_names}
+
+    def _link_shader_program(self, sources_and_shadertypes):
+        program_handle = pyglet.gl.glCreateProgram()
 
         handles = []
         temp = ctypes.c_int(0)
@@ -139,55 +218,69 @@ class _OpenGLRenderer(_AbstractRenderer, ABC):
                 # Raise error with log content.
                 raise RuntimeError(buffer.value.decode())
             
-            pyglet.gl.glAttachShader(self._shader_handle, handle)
+            pyglet.gl.glAttachShader(program_handle, handle)
             
-        pyglet.gl.glLinkProgram(self._shader_handle)
+        pyglet.gl.glLinkProgram(program_handle)
 
         # Check if error occurred.
-        pyglet.gl.glGetProgramiv(self._shader_handle, pyglet.gl.GL_LINK_STATUS, ctypes.byref(temp))
+        pyglet.gl.glGetProgramiv(program_handle, pyglet.gl.GL_LINK_STATUS, ctypes.byref(temp))
         if not temp:
             # Retrieve the log length.
-            pyglet.gl.glGetProgramiv(self._shader_handle, pyglet.gl.GL_INFO_LOG_LENGTH, ctypes.byref(temp))
+            pyglet.gl.glGetProgramiv(program_handle, pyglet.gl.GL_INFO_LOG_LENGTH, ctypes.byref(temp))
             # Create a buffer for the log.
             buffer = ctypes.create_string_buffer(temp.value)
             # Retrieve the log text.
-            pyglet.gl.glGetProgramInfoLog(self._shader_handle, temp, None, buffer)
+            pyglet.gl.glGetProgramInfoLog(program_handle, temp, None, buffer)
             # Raise error with log content.
             raise RuntimeError(buffer.value.decode())
 
         for handle in handles:
-            pyglet.gl.glDetachShader(self._shader_handle, handle)
+            pyglet.gl.glDetachShader(program_handle, handle)
             pyglet.gl.glDeleteShader(handle)
 
-    def _allocate_vbo_vao(self):
-        buffer_id = pyglet.gl.GLuint()
-        pyglet.gl.glGenBuffers(1, buffer_id)
-        self._vbo_handle = buffer_id.value
+        return program_handle
+
+    def _set_uniforms(self):
+        # Uniforms are part of the state of the shader program: as they never change, they are only set once.
+        location, projection = self._prepare_params_to_set_uniform('projection', self._get_projection_matrix(), ctypes.c_float)
+        pyglet.gl.glProgramUniformMatrix4fv(self._shader_handle, location, 1, False, projection)
 
+    def _allocate_vao(self):
+        # Objects are created with glCreate* rather than glGen* so that they can be used with direct state access
+        # functions without ever being bound.
         array_id = pyglet.gl.GLuint()
-        pyglet.gl.glGenVertexArrays(1, array_id)
+        pyglet.gl.glCreateVertexArrays(1, array_id)
         self._vao_handle = array_id.value
-        
+
     def recalculate(self):
-        self._update_vbo()
-        self._update_vao()
+        if self._last_revision == self._tilemap.revision:
+            return
+        self._last_revision = self._tilemap.revision
+
+        # Only update the tiles modified since the last upload, unless so many of them changed
+        # that updating everything at once is cheaper.
+        dirty_tiles = self._tilemap.dirty_tiles
+        if len(dirty_tiles) < len(self._tilemap) / 4:
+            self._update_tiles(dirty_tiles)
+        else:
+            self._update_tiles()
+        dirty_tiles.clear()
 
     def _prepare_params_to_set_uniform(self, name, values, ctype_type):
-        name = ctypes.create_string_buffer(name.encode('utf-8'))
-        location = pyglet.gl.glGetUniformLocation(self._shader_handle, name)
+        location = self._uniform_locations[name]
 
-        try:
-            values = (ctype_type * len(values))(*values)
-        except:
+        if hasattr(values, '__len__'):
+            # Convert the whole sequence at once through NumPy instead of passing each element to ctypes.
+            values = (ctype_type * len(values)).from_buffer_copy(np.asarray(values, dtype=ctype_type))
+        else:
             values = ctype_type(values)
 
         return location, values
     
     def __del__(self):
         try:
-            pyglet.gl.glDeleteVertexArrays(1, ctypes.c_ulong(self._vao_handle))
-            pyglet.gl.glDeleteBuffers(1, ctypes.c_ulong(self._vbo_handle))
-            pyglet.gl.glDeleteProgram(self._shader_handle)
+            # The shader program is not deleted as it is shared with other instances.
+            pyglet.gl.glDeleteVertexArrays(1, pyglet.gl.GLuint(self._vao_handle))
         except:
             # When closing window the OpenGL context is deallocated before this destructor gets called.
             # This raises an exception but should not cause memory leaks given the program is exiting.
@@ -198,133 +291,223 @@ class _OpenGLRenderer(_AbstractRenderer, ABC):
 
 
 class VertexBufferedRenderer(_OpenGLRenderer):
+    # Offset of each vertex from the top left corner of the tile:
+    # top left, top right, bottom left, bottom right.
+    _vertex_dx = np.array([0, 1, 0, 1], dtype=np.float32)
+    _vertex_dy = np.array([0, 0, 1, 1], dtype=np.float32)
+
+    def __init__(self, tilemap):
+        # Positions and texcoords are stored in separate buffers: self._vbo_handle only holds texcoords,
+        # the only vertex data which depends on the content of the tilemap.
+        self._vbo_handle = None
+        self._position_vbo_handle = None
+        self._ibo_handle = None
+
+        self._vbo_region_size = None
+        self._vbo_mapped_ptr = None
+        self._vbo_fences = [None] * VBO_RING_SIZE
+        self._vbo_region = 0
+
+        # Copy of the latest texcoords, so that only the ones of modified tiles need to be regenerated.
+        # Tiles indexed as [y, x], matching the row-major layout of the tilemap and the order in which vertices
+        # are laid out in the buffer.
+        self._texcoord_data = np.empty((TILEMAP_N_ROWS, TILEMAP_N_COLS, 4, 2), dtype=np.float32)
+        # for each tile
+        # there are 4 vertices (the corners shared by its two triangles)
+        # each vertex texcoord has two fields: x and y
+
+        # Tile ids of the whole tilemap, rewritten on each full update instead of allocating a new array.
+        self._tile_data = np.empty((TILEMAP_N_ROWS, TILEMAP_N_COLS), dtype=np.uint32)
+
+        self._texcoord_lut = _build_texcoord_lut(tilemap.max_value + 1, self._vertex_dx, self._vertex_dy)
+
+        super().__init__(tilemap)
 
     def _create_shader(self):
-        vert_source = open(os.path.join(SHADERS_FOLDER, 'VertexBufferedRenderer.vert')).read()
-        frag_source = open(os.path.join(SHADERS_FOLDER, 'VertexBufferedRenderer.frag')).read()
+        vert_source = _load_shader_source('VertexBufferedRenderer.vert')
+        frag_source = _load_shader_source('VertexBufferedRenderer.frag')
 
         self._compile_shader_program([(vert_source, pyglet.gl.GL_VERTEX_SHADER),
                                       (frag_source, pyglet.gl.GL_FRAGMENT_SHADER)])
 
 
+    def _allocate_buffers(self):
+        buffer_ids = (pyglet.gl.GLuint * 3)()
+        pyglet.gl.glCreateBuffers(3, buffer_ids)
+        self._vbo_handle, self._position_vbo_handle, self._ibo_handle = buffer_ids
+
+        # The texcoord VBO is allocated once with room for VBO_RING_SIZE copies of the texcoords and stays mapped for the
+        # lifetime of the renderer. Updates are written directly through the mapped pointer, each one into the next
+        # region of the ring, so the driver never has to reallocate the buffer nor wait on draws still reading it.
+        # Each region holds 4 vertices per tile, each with a texcoord made of two floats.
+        self._vbo_region_size = len(self._tilemap) * 4 * 2 * ctypes.sizeof(ctypes.c_float)
+        flags = pyglet.gl.GL_MAP_PERSISTENT_BIT | pyglet.gl.GL_MAP_WRITE_BIT | pyglet.gl.GL_MAP_COHERENT_BIT
+
+        pyglet.gl.glNamedBufferStorage(self._vbo_handle, self._vbo_region_size * VBO_RING_SIZE, None, flags)
+        self._vbo_mapped_ptr = pyglet.gl.glMapNamedBufferRange(self._vbo_handle, 0, self._vbo_region_size * VBO_RING_SIZE,
+                                                               flags | pyglet.gl.GL_MAP_INVALIDATE_BUFFER_BIT)
+
+        # Positions and indices only depend on the size of the tilemap, so they are uploaded only once.
+        self._update_position_vbo()
+        self._update_ibo()
+
+
+    def _update_tiles(self, dirty_tiles=None):
+        self._update_vbo(dirty_tiles)
+        self._update_vao()
+
+
     def draw(self):
-        pyglet.gl.glBindTexture(pyglet.gl.GL_TEXTURE_2D, self._texture_id)
+        pyglet.gl.glBindTextureUnit(0, self._texture_id)
         pyglet.gl.glBindVertexArray(self._vao_handle)
+        pyglet.gl.glUseProgram(self._shader_handle)
 
-        projection = self._get_projection_matrix()
+        n_indices_per_tile = 6 # Each tile has 2 triangles, each with 3 vertices
+        pyglet.gl.glDrawElements(pyglet.gl.GL_TRIANGLES, len(self._tilemap) * n_indices_per_tile, pyglet.gl.GL_UNSIGNED_INT, 0)
+
+
+    def _write_vbo(self, data):
+        # A fence covers all the commands issued before it: fencing the region being left once, right before moving
+        # on to the next one, covers every draw call which read from it.
+        self._fence_vbo()
+        self._vbo_region = (self._vbo_region + 1) % VBO_RING_SIZE
+
+        # Wait for the GPU to be done with the draw calls which last read from this region before overwriting it.
+        fence = self._vbo_fences[self._vbo_region]
+        if fence:
+            while pyglet.gl.glClientWaitSync(fence, pyglet.gl.GL_SYNC_FLUSH_COMMANDS_BIT, 1_000_000) == pyglet.gl.GL_TIMEOUT_EXPIRED:
+                pass
+            pyglet.gl.glDeleteSync(fence)
+            self._vbo_fences[self._vbo_region] = None
+
+        ctypes.memmove(self._vbo_mapped_ptr + self._vbo_region * self._vbo_region_size, data.ctypes.data, data.nbytes)
 
-        location, projection = self._prepare_params_to_set_uniform('projection', projection, ctypes.c_float)
-        pyglet.gl.glProgramUniformMatrix4fv(self._shader_handle, location, 1, False, projection)
-        
-        pyglet.gl.glUseProgram(self._shader_handle)
-        n_vertices_per_tile = 6 # Each tile has 2 triangles, each with 3 vertices
-        pyglet.gl.glDrawArrays(pyglet.gl.GL_TRIANGLES, 0, len(self._tilemap) * n_vertices_per_tile)
 
+    def _get_vbo_offset(self):
+        return self._vbo_region * self._vbo_region_size
 
-    def _update_vbo(self):
 
-        float_count = len(self._tilemap) * 6 * 2 * 2
+    def _fence_vbo(self):
+        # Mark the point after which the GPU is done reading the current region of the VBO.
+        if self._vbo_fences[self._vbo_region]:
+            pyglet.gl.glDeleteSync(self._vbo_fences[self._vbo_region])
+        self._vbo_fences[self._vbo_region] = pyglet.gl.glFenceSync(pyglet.gl.GL_SYNC_GPU_COMMANDS_COMPLETE, 0)
+
+
+    def _update_position_vbo(self):
+        position_data = np.empty((TILEMAP_N_ROWS, TILEMAP_N_COLS, 4, 2), dtype=np.float32)
         # for each tile
-        # there are 6 vertices (two triangles, each with 3 vertices)
-        # each vertex has two components: Position and Texcoord
-        # each component has two fields: x and y
+        # there are 4 vertices (the corners shared by its two triangles)
+        # each vertex position has two fields: x and y
 
-        vertex_data = [0.0] * float_count
+        position_data[..., 0] = np.arange(TILEMAP_N_COLS, dtype=np.float32)[None, :, None] + self._vertex_dx # position x
+        position_data[..., 1] = np.arange(TILEMAP_N_ROWS, dtype=np.float32)[:, None, None] + self._vertex_dy # position y
+
+        pyglet.gl.glNamedBufferData(self._position_vbo_handle, position_data.nbytes, position_data.ctypes.data, pyglet.gl.GL_STATIC_DRAW)
+
+
+    def _update_vbo(self, dirty_tiles=None):
+        if dirty_tiles is None:
+            self._tile_data.ravel()[:] = self._tilemap.map
+            # Tile ids are already bounds checked by the tilemap: with the default mode='raise', NumPy would gather
+            # into a temporary copy of the output to be able to report an out of bounds id.
+            np.take(self._texcoord_lut, self._tile_data, axis=0, out=self._texcoord_data, mode='clip')
+        else:
+            index = ([row for row, _ in dirty_tiles], [col for _, col in dirty_tiles])
+            tiles = np.array([self._tilemap[row, col] for row, col in dirty_tiles], dtype=np.uint32)
+            self._texcoord_data[index] = self._texcoord_lut[tiles]
+
+        # The region of the ring being written to holds texcoords from a few updates ago:
+        # it is cheaper to copy all of them again than to track which ones are outdated.
+        self._write_vbo(self._texcoord_data)
 
-        i = 0
-        for x in range(TILEMAP_N_COLS):
-            for y in range(TILEMAP_N_ROWS):
-                tile = self._tilemap[y, x]
 
-                # Calculate normalized texture coordinates. Use padding to mitigate the lines-between tiles bug
-                # which is caused by the lack of tile margins in the texture atlas.
-                tx0 = (tile %  TEXTURE_N_TILES_PER_ROW) * TEXTURE_TILE_SIZE_NORMALIZED + TEXTURE_TILE_PADDING
-                ty0 = (tile // TEXTURE_N_TILES_PER_ROW) * TEXTURE_TILE_SIZE_NORMALIZED + TEXTURE_TILE_PADDING
-                tSize = TEXTURE_TILE_SIZE_NORMALIZED - TEXTURE_TILE_PADDING * 2
-
-                # vertex 0 (top left)
-                vertex_data[i + 0] = x # position x
-                vertex_data[i + 1] = y # position y
-                vertex_data[i + 2] = tx0 # texcoord x
-                vertex_data[i + 3] = ty0 # texcoord y
-                i += 4
-
-                # vertex 1 (top right)
-                vertex_data[i + 0] = x + 1 # position x
-                vertex_data[i + 1] = y # position y
-                vertex_data[i + 2] = tx0 + tSize # texcoord x
-                vertex_data[i + 3] = ty0 # texcoord y
-                i += 4
-
-                # vertex 2 (bottom left)
-                vertex_data[i + 0] = x # position x
-                vertex_data[i + 1] = y + 1 # position y
-                vertex_data[i + 2] = tx0 # texcoord x
-                vertex_data[i + 3] = ty0 + tSize # texcoord y
-                i += 4
-
-                # vertex 3 (top right)
-                vertex_data[i + 0] = x + 1 # position x
-                vertex_data[i + 1] = y # position y
-                vertex_data[i + 2] = tx0 + tSize # texcoord x
-                vertex_data[i + 3] = ty0 # texcoord y
-                i += 4
-
-                # vertex 4 (bottom left)
-                vertex_data[i + 0] = x # position x
-                vertex_data[i + 1] = y + 1 # position y
-                vertex_data[i + 2] = tx0 # texcoord x
-                vertex_data[i + 3] = ty0 + tSize # texcoord y
-                i += 4
-
-                # vertex 5 (bottom right)
-                vertex_data[i + 0] = x + 1 # position x
-                vertex_data[i + 1] = y + 1 # position y
-                vertex_data[i + 2] = tx0 + tSize # texcoord x
-                vertex_data[i + 3] = ty0 + tSize # texcoord y
-                i += 4
-
-        l = len(vertex_data)
-        vertex_data = (ctypes.c_float * l)(*vertex_data)
-
-        pyglet.gl.glBindBuffer(pyglet.gl.GL_ARRAY_BUFFER, self._vbo_handle)
-        pyglet.gl.glBufferData(pyglet.gl.GL_ARRAY_BUFFER, l * ctypes.sizeof(ctypes.c_float), vertex_data, pyglet.gl.GL_STATIC_DRAW)
+    def _update_ibo(self):
+        # Each tile is drawn as two triangles: (top left, top right, bottom left) and (top right, bottom left, bottom right).
+        n_vertices_per_tile = 4
+        index_data = np.arange(len(self._tilemap), dtype=np.uint32)[:, None] * n_vertices_per_tile + np.array([0, 1, 2, 1, 2, 3], dtype=np.uint32)
+
+        pyglet.gl.glNamedBufferData(self._ibo_handle, index_data.nbytes, index_data.ctypes.data, pyglet.gl.GL_STATIC_DRAW)
+        pyglet.gl.glVertexArrayElementBuffer(self._vao_handle, self._ibo_handle)
 
 
     def _update_vao(self):
-        pyglet.gl.glBindVertexArray(self._vao_handle)
-        
-        pyglet.gl.glBindBuffer(pyglet.gl.GL_ARRAY_BUFFER, self._vbo_handle)
-        
         n_coords_vertex_position     = 2
         n_coords_texture_coordinates = 2
 
-        pyglet.gl.glEnableVertexAttribArray(0)
-        pyglet.gl.glVertexAttribPointer(0, # Attribute number given in vertex shader layout()
-                                        n_coords_vertex_position, # Number of elements needed to build attribute (here vec2)
-                                        pyglet.gl.GL_FLOAT, # Type of attribute
-                                        False, # Do not normalize
-                                        ctypes.sizeof(ctypes.c_float) * (n_coords_vertex_position + n_coords_texture_coordinates), # Stride to reach start of next vertex
-                                        0) # No offset: first elements in vertex array are position, not texcoords.
-
-        pyglet.gl.glEnableVertexAttribArray(1)
-        pyglet.gl.glVertexAttribPointer(1, # Attribute number given in vertex shader layout()
-                                        n_coords_texture_coordinates, # Number of elements needed to build attribute (here vec2)
-                                        pyglet.gl.GL_FLOAT, # Type of attribute
-                                        False, # Do not normalize
-                                        ctypes.sizeof(ctypes.c_float) * (n_coords_vertex_position + n_coords_texture_coordinates), # Stride to reach start of next vertex
-                                        ctypes.sizeof(ctypes.c_float) * n_coords_vertex_position) # Offset by the number of elements in vertex position (previous attribute)
+        pyglet.gl.glVertexArrayVertexBuffer(self._vao_handle,
+                                            0, # Binding index
+                                            self._position_vbo_handle,
+                                            0, # No offset: buffer only contains positions.
+                                            ctypes.sizeof(ctypes.c_float) * n_coords_vertex_position) # Stride to reach start of next vertex
+        pyglet.gl.glEnableVertexArrayAttrib(self._vao_handle, 0)
+        pyglet.gl.glVertexArrayAttribFormat(self._vao_handle,
+                                            0, # Attribute number given in vertex shader layout()
+                                            n_coords_vertex_position, # Number of elements needed to build attribute (here vec2)
+                                            pyglet.gl.GL_FLOAT, # Type of attribute
+                                            False, # Do not normalize
+                                            0) # No offset relative to the start of the vertex
+        pyglet.gl.glVertexArrayAttribBinding(self._vao_handle, 0, 0)
+
+        pyglet.gl.glVertexArrayVertexBuffer(self._vao_handle,
+                                            1, # Binding index
+                                            self._vbo_handle,
+                                            self._get_vbo_offset(), # Start of the region of the ring holding the latest texcoords.
+                                            ctypes.sizeof(ctypes.c_float) * n_coords_texture_coordinates) # Stride to reach start of next vertex
+        pyglet.gl.glEnableVertexArrayAttrib(self._vao_handle, 1)
+        pyglet.gl.glVertexArrayAttribFormat(self._vao_handle,
+                                            1, # Attribute number given in vertex shader layout()
+                                            n_coords_texture_coordinates, # Number of elements needed to build attribute (here vec2)
+                                            pyglet.gl.GL_FLOAT, # Type of attribute
+                                            False, # Do not normalize
+                                            0) # No offset relative to the start of the vertex
+        pyglet.gl.glVertexArrayAttribBinding(self._vao_handle, 1, 1)
+
+
+    def __del__(self):
+        try:
+            for fence in self._vbo_fences:
+                if fence:
+                    pyglet.gl.glDeleteSync(fence)
+            pyglet.gl.glDeleteBuffers(1, pyglet.gl.GLuint(self._vbo_handle))
+            pyglet.gl.glDeleteBuffers(1, pyglet.gl.GLuint(self._position_vbo_handle))
+            pyglet.gl.glDeleteBuffers(1, pyglet.gl.GLuint(self._ibo_handle))
+        except:
+            # See _OpenGLRenderer.__del__.
+            pass
+
+        super().__del__()
         
 
 
 
 
 class GeomBufferedRenderer(_OpenGLRenderer):
+    _uniform_names = ('projection', 'n_cols', 'tilemap')
+
+    def __init__(self, tilemap):
+        self._tilemap_texture_id = None
+        self._pbo_handle = None
+        self._tile_data = None
+
+        # Store tile ids in the narrowest unsigned integer type able to hold all of them,
+        # to reduce the size of the tilemap texture and of the data uploaded to it.
+        if tilemap.max_value <= 0xFF:
+            self._tile_ctype, self._tile_internal_format, self._tile_gl_type = ctypes.c_uint8 , pyglet.gl.GL_R8UI , pyglet.gl.GL_UNSIGNED_BYTE
+        elif tilemap.max_value <= 0xFFFF:
+            self._tile_ctype, self._tile_internal_format, self._tile_gl_type = ctypes.c_uint16, pyglet.gl.GL_R16UI, pyglet.gl.GL_UNSIGNED_SHORT
+        else:
+            self._tile_ctype, self._tile_internal_format, self._tile_gl_type = ctypes.c_uint32, pyglet.gl.GL_R32UI, pyglet.gl.GL_UNSIGNED_INT
+
+        # Tile ids of the whole tilemap, rewritten on each full update instead of allocating a new array.
+        self._tile_data = np.empty(len(tilemap), dtype=self._tile_ctype)
+
+        super().__init__(tilemap)
 
     def _create_shader(self):
-        vert_source = open(os.path.join(SHADERS_FOLDER, 'GeometryShaderRenderer.vert')).read()
-        frag_source = open(os.path.join(SHADERS_FOLDER, 'GeometryShaderRenderer.frag')).read()
-        geom_source = open(os.path.join(SHADERS_FOLDER, 'GeometryShaderRenderer.geom')).read() \
+        vert_source = _load_shader_source('GeometryShaderRenderer.vert')
+        frag_source = _load_shader_source('GeometryShaderRenderer.frag')
+        geom_source = _load_shader_source('GeometryShaderRenderer.geom') \
                           .replace('{TEXTURE_N_TILES_PER_ROW}'     , f'{TEXTURE_N_TILES_PER_ROW}u') \
                           .replace('{TEXTURE_TILE_SIZE_NORMALIZED}', f'{TEXTURE_TILE_SIZE_NORMALIZED}') \
                           .replace('{TEXTURE_TILE_PADDING}'        , f'{TEXTURE_TILE_PADDING}')
@@ -333,40 +516,87 @@ class GeomBufferedRenderer(_OpenGLRenderer):
                                       (frag_source, pyglet.gl.GL_FRAGMENT_SHADER),
                                       (geom_source, pyglet.gl.GL_GEOMETRY_SHADER)])
 
-    def draw(self):
-        pyglet.gl.glBindTexture(pyglet.gl.GL_TEXTURE_2D, self._texture_id)
-        pyglet.gl.glBindVertexArray(self._vao_handle)
-
-        projection = self._get_projection_matrix()
+    def _set_uniforms(self):
+        super()._set_uniforms()
 
-        location, projection = self._prepare_params_to_set_uniform('projection', projection, ctypes.c_float)
-        pyglet.gl.glProgramUniformMatrix4fv(self._shader_handle, location, 1, False, projection)
-        
         location, n_cols = self._prepare_params_to_set_uniform('n_cols', TILEMAP_N_COLS, ctypes.c_int)
         pyglet.gl.glProgramUniform1i(self._shader_handle, location, n_cols)
 
-        pyglet.gl.glUseProgram(self._shader_handle)
-        pyglet.gl.glDrawArrays(pyglet.gl.GL_POINTS, 0, len(self._tilemap))
-        
-        
-    def _update_vbo(self):
+        # Texture unit 0 is used by the texture atlas, the tilemap is bound to texture unit 1.
+        location, texture_unit = self._prepare_params_to_set_uniform('tilemap', 1, ctypes.c_int)
+        pyglet.gl.glProgramUniform1i(self._shader_handle, location, texture_unit)
 
-        vertex_data = self._tilemap.map
+    def _allocate_buffers(self):
+        # Tile ids are stored in a texture which the vertex shader fetches from using gl_VertexID,
+        # so the VAO does not need any vertex attribute.
+        texture_id = pyglet.gl.GLuint()
+        pyglet.gl.glCreateTextures(pyglet.gl.GL_TEXTURE_2D, 1, texture_id)
+        self._tilemap_texture_id = texture_id.value
 
-        l = len(vertex_data)
-        vertex_data = (ctypes.c_uint32 * l)(*vertex_data)
+        pyglet.gl.glTextureStorage2D(self._tilemap_texture_id, 1, self._tile_internal_format, TILEMAP_N_COLS, TILEMAP_N_ROWS)
 
-        pyglet.gl.glBindBuffer(pyglet.gl.GL_ARRAY_BUFFER, self._vbo_handle)
-        pyglet.gl.glBufferData(pyglet.gl.GL_ARRAY_BUFFER, l * ctypes.sizeof(ctypes.c_uint32), vertex_data, pyglet.gl.GL_STATIC_DRAW)
+        # Integer textures are incomplete unless sampled with nearest neighbour filtering.
+        pyglet.gl.glTextureParameteri(self._tilemap_texture_id, pyglet.gl.GL_TEXTURE_MIN_FILTER, pyglet.gl.GL_NEAREST)
+        pyglet.gl.glTextureParameteri(self._tilemap_texture_id, pyglet.gl.GL_TEXTURE_MAG_FILTER, pyglet.gl.GL_NEAREST)
 
+        # Tile ids are staged in a pixel unpack buffer, so that copying them into the texture does not stall the CPU.
+        pbo_handle = pyglet.gl.GLuint()
+        pyglet.gl.glCreateBuffers(1, pbo_handle)
+        self._pbo_handle = pbo_handle.value
 
-    def _update_vao(self):
+    def draw(self):
+        pyglet.gl.glBindTextureUnit(0, self._texture_id)
+        pyglet.gl.glBindTextureUnit(1, self._tilemap_texture_id)
         pyglet.gl.glBindVertexArray(self._vao_handle)
+        pyglet.gl.glUseProgram(self._shader_handle)
+
+        pyglet.gl.glDrawArrays(pyglet.gl.GL_POINTS, 0, len(self._tilemap))
         
-        pyglet.gl.glBindBuffer(pyglet.gl.GL_ARRAY_BUFFER, self._vbo_handle)
         
-        pyglet.gl.glEnableVertexAttribArray(0)
-        pyglet.gl.glVertexAttribIPointer(0, 1, pyglet.gl.GL_UNSIGNED_INT, ctypes.sizeof(ctypes.c_uint32), 0)
+    def _update_tiles(self, dirty_tiles=None):
+        self._update_tilemap_tex(dirty_tiles)
+
+    def _update_tilemap_tex(self, dirty_tiles=None):
+        if dirty_tiles is None:
+            self._tile_data[:] = self._tilemap.map
+            tile_data = self._tile_data
+        elif dirty_tiles:
+            dirty_tiles = list(dirty_tiles)
+            tile_data = np.array([self._tilemap[row, col] for row, col in dirty_tiles], dtype=self._tile_ctype)
+        else:
+            return
+
+        # Orphan the buffer before filling it: the driver hands out new storage instead of waiting for the copies
+        # to the texture which still read the previous content. Those copies are then performed by the GPU
+        # asynchronously, sourcing from the buffer rather than from client memory.
+        pyglet.gl.glNamedBufferData(self._pbo_handle, tile_data.nbytes, None, pyglet.gl.GL_STREAM_DRAW)
+        pyglet.gl.glNamedBufferSubData(self._pbo_handle, 0, tile_data.nbytes, tile_data.ctypes.data)
+        pyglet.gl.glBindBuffer(pyglet.gl.GL_PIXEL_UNPACK_BUFFER, self._pbo_handle)
+
+        if dirty_tiles is None:
+            # Texture rows match the rows of the tilemap.
+            # Rows of 1 or 2 byte texels are tightly packed, not padded to the default 4 bytes alignment.
+            pyglet.gl.glPixelStorei(pyglet.gl.GL_UNPACK_ALIGNMENT, 1)
+            pyglet.gl.glTextureSubImage2D(self._tilemap_texture_id, 0, 0, 0, TILEMAP_N_COLS, TILEMAP_N_ROWS,
+                                          pyglet.gl.GL_RED_INTEGER, self._tile_gl_type, 0)
+        else:
+            # Last argument is the offset of the tile id in the buffer.
+            for i, (row, col) in enumerate(dirty_tiles):
+                pyglet.gl.glTextureSubImage2D(self._tilemap_texture_id, 0, col, row, 1, 1,
+                                              pyglet.gl.GL_RED_INTEGER, self._tile_gl_type, i * tile_data.itemsize)
+
+        # Texture uploads done by pyglet itself expect to read from client memory.
+        pyglet.gl.glBindBuffer(pyglet.gl.GL_PIXEL_UNPACK_BUFFER, 0)
+
+    def __del__(self):
+        try:
+            pyglet.gl.glDeleteTextures(1, pyglet.gl.GLuint(self._tilemap_texture_id))
+            pyglet.gl.glDeleteBuffers(1, pyglet.gl.GLuint(self._pbo_handle))
+        except:
+            # See _OpenGLRenderer.__del__.
+            pass
+
+        super().__del__()
 
 
 
@@ -374,6 +604,14 @@ class GeomBufferedRenderer(_OpenGLRenderer):
 
 
 class Pyglet_VertexBufferedRenderer(_AbstractRenderer):
+    # Shader program shared by all instances, compiled the first time it is needed.
+    _cached_shader_program = None
+
+    # Offset of each vertex from the top left corner of the tile:
+    # top left, top right, bottom left, top right, bottom left, bottom right.
+    _vertex_dx = np.array([0, 1, 0, 1, 0, 1], dtype=np.float32)
+    _vertex_dy = np.array([0, 0, 1, 0, 1, 1], dtype=np.float32)
+
     def __init__(self, tilemap):
         self._tilemap = tilemap
         self._texture_id = tilemap.texture.id
@@ -381,18 +619,30 @@ class Pyglet_VertexBufferedRenderer(_AbstractRenderer):
         self._shader_program = None
         self._vertex_list = None
 
+        # Tile ids of the whole tilemap, rewritten on each update instead of allocating a new array.
+        # Tiles indexed as [y, x], matching the row-major layout of the tilemap.
+        self._tile_data = np.empty((TILEMAP_N_ROWS, TILEMAP_N_COLS), dtype=np.uint32)
+
+        self._texcoord_lut = _build_texcoord_lut(tilemap.max_value + 1, self._vertex_dx, self._vertex_dy)
+
+        # Revision of the tilemap when the vertex list was last updated.
+        self._last_revision = None
+
         self._create_shader()
         self._allocate_vertex_list()
         self.recalculate()
         
 
     def _create_shader(self):
-        vert_source = open(os.path.join(SHADERS_FOLDER, 'VertexBufferedRenderer.vert')).read()
-        frag_source = open(os.path.join(SHADERS_FOLDER, 'VertexBufferedRenderer.frag')).read()
+        if Pyglet_VertexBufferedRenderer._cached_shader_program is None:
+            vert_source = _load_shader_source('VertexBufferedRenderer.vert')
+            frag_source = _load_shader_source('VertexBufferedRenderer.frag')
 
-        vert_shader = pyglet.graphics.shader.Shader(vert_source, 'vertex')
-        frag_shader = pyglet.graphics.shader.Shader(frag_source, 'fragment')
-        self._shader_program = pyglet.graphics.shader.ShaderProgram(vert_shader, frag_shader)
+            vert_shader = pyglet.graphics.shader.Shader(vert_source, 'vertex')
+            frag_shader = pyglet.graphics.shader.Shader(frag_source, 'fragment')
+            Pyglet_VertexBufferedRenderer._cached_shader_program = pyglet.graphics.shader.ShaderProgram(vert_shader, frag_shader)
+
+        self._shader_program = Pyglet_VertexBufferedRenderer._cached_shader_program
 
 
     def _allocate_vertex_list(self):
@@ -402,76 +652,65 @@ class Pyglet_VertexBufferedRenderer(_AbstractRenderer):
 
         self._vertex_list = self._shader_program.vertex_list(vertex_count, pyglet.gl.GL_TRIANGLES)
 
+        # Positions only depend on the size of the tilemap, so they are written only once.
+        position_data = np.empty((TILEMAP_N_ROWS, TILEMAP_N_COLS, 6, 2), dtype=np.float32)
+        # for each tile
+        # there are 6 vertices (two triangles, each with 3 vertices)
+        # each vertex position has two fields: x and y
+
+        position_data[..., 0] = np.arange(TILEMAP_N_COLS, dtype=np.float32)[None, :, None] + self._vertex_dx # position x
+        position_data[..., 1] = np.arange(TILEMAP_N_ROWS, dtype=np.float32)[:, None, None] + self._vertex_dy # position y
+
+        # Copy through NumPy: a single contiguous copy instead of assigning to the ctypes arrays one element at a time.
+        np.ctypeslib.as_array(self._vertex_list.aPosition)[:] = position_data.ravel()
+
 
     def recalculate(self):
-        float_count = len(self._vertex_list.aPosition)
+        if self._last_revision == self._tilemap.revision:
+            return
+        self._last_revision = self._tilemap.revision
 
-        position_data = [0.0] * float_count
-        texcoord_data = [0.0] * float_count
+        self._tile_data.ravel()[:] = self._tilemap.map
 
-        i = 0
-        for x in range(TILEMAP_N_COLS):
-            for y in range(TILEMAP_N_ROWS):
-                tile = self._tilemap[y, x]
+        # Gather the texcoords straight into the vertex list's region of the vertex buffer, with no intermediate copy.
+        # The region must be fetched again on each update: accessing it flags it for upload, and the buffer may have
+        # been reallocated since when vertex lists of other instances were added to the shared domain.
+        texcoord_data = np.ctypeslib.as_array(self._vertex_list.aTexCoord).reshape(TILEMAP_N_ROWS, TILEMAP_N_COLS, 6, 2)
+        # for each tile
+        # there are 6 vertices (two triangles, each with 3 vertices)
+        # each vertex texcoord has two fields: x and y
 
-                # Calculate normalized texture coordinates. Use padding to mitigate the lines-between tiles bug
-                # which is caused by the lack of tile margins in the texture atlas.
-                tx0 = (tile %  TEXTURE_N_TILES_PER_ROW) * TEXTURE_TILE_SIZE_NORMALIZED + TEXTURE_TILE_PADDING
-                ty0 = (tile // TEXTURE_N_TILES_PER_ROW) * TEXTURE_TILE_SIZE_NORMALIZED + TEXTURE_TILE_PADDING
-                tSize = TEXTURE_TILE_SIZE_NORMALIZED - TEXTURE_TILE_PADDING * 2
-
-                # vertex 0 (top left)
-                position_data[i + 0] = x # position x
-                position_data[i + 1] = y # position y
-                texcoord_data[i + 0] = tx0 # texcoord x
-                texcoord_data[i + 1] = ty0 # texcoord y
-                i += 2
-
-                # vertex 1 (top right)
-                position_data[i + 0] = x + 1 # position x
-                position_data[i + 1] = y # position y
-                texcoord_data[i + 0] = tx0 + tSize # texcoord x
-                texcoord_data[i + 1] = ty0 # texcoord y
-                i += 2
-
-                # vertex 2 (bottom left)
-                position_data[i + 0] = x # position x
-                position_data[i + 1] = y + 1 # position y
-                texcoord_data[i + 0] = tx0 # texcoord x
-                texcoord_data[i + 1] = ty0 + tSize # texcoord y
-                i += 2
-
-                # vertex 3 (top right)
-                position_data[i + 0] = x + 1 # position x
-                position_data[i + 1] = y # position y
-                texcoord_data[i + 0] = tx0 + tSize # texcoord x
-                texcoord_data[i + 1] = ty0 # texcoord y
-                i += 2
-
-                # vertex 4 (bottom left)
-                position_data[i + 0] = x # position x
-                position_data[i + 1] = y + 1 # position y
-                texcoord_data[i + 0] = tx0 # texcoord x
-                texcoord_data[i + 1] = ty0 + tSize # texcoord y
-                i += 2
-
-                # vertex 5 (bottom right)
-                position_data[i + 0] = x + 1 # position x
-                position_data[i + 1] = y + 1 # position y
-                texcoord_data[i + 0] = tx0 + tSize # texcoord x
-                texcoord_data[i + 1] = ty0 + tSize # texcoord y
-                i += 2
-
-        self._vertex_list.aPosition[:] = position_data
-        self._vertex_list.aTexCoord[:] = texcoord_data
+        # See VertexBufferedRenderer._update_vbo for mode='clip'.
+        np.take(self._texcoord_lut, self._tile_data, axis=0, out=texcoord_data, mode='clip')
 
 
     def draw(self):
         self._shader_program.use()
         pyglet.gl.glBindTexture(pyglet.gl.GL_TEXTURE_2D, self._texture_id)
 
-        projection = self._get_projection_matrix()
-        self._shader_program['projection'] = projection
+        self._shader_program['projection'] = self._get_projection_matrix()
 
         self._vertex_list.draw(pyglet.gl.GL_TRIANGLES)
-        self._shader_program.stop()
\ No newline at end of file
+        self._shader_program.stop()
+
+
+    def __del__(self):
+        # The shader program, and therefore the vertex domain holding the vertex list, are shared with other instances:
+        # free the space used by this one.
+        try:
+            self._vertex_list.delete()
+        except:
+            # See _OpenGLRenderer.__del__.
+            pass
+
+
+
+
+
+def get_default_renderer_cls():
+    # Expanding tiles into quads in a geometry shader only requires uploading one tile id per tile instead of the
+    # texcoords of all their vertices. Otherwise fall back to the renderer built on Pyglet's ShaderProgram.
+    if GeomBufferedRenderer.is_supported():
+        return GeomBufferedRenderer
+
+    return Pyglet_VertexBufferedRenderer
\ No newline at end of file
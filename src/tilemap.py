@@ -24,12 +24,18 @@ class TileMap:
 
         self._map = [0] * self._rows * self._cols
 
+        # (row, col) of the tiles modified since the renderer last uploaded the tilemap.
+        self._dirty_tiles = set()
+
+        # Incremented on each modification, so that renderers can tell whether the tilemap changed since they last read it.
+        self._revision = 0
+
     def _cvt_idx(self, idx):
         row, col = idx
 
-        if row > self._rows or row < 0:
+        if row >= self._rows or row < 0:
             raise IndexError
-        if col > self._cols or col < 0:
+        if col >= self._cols or col < 0:
             raise IndexError
         return row * self._cols + col
 
@@ -38,12 +44,15 @@ class TileMap:
         return self._map[idx]
 
     def __setitem__(self, idx, value):
+        row, col = idx
         idx = self._cvt_idx(idx)
 
         if value > self._max_value or value < 0:
             raise IndexError
 
         self._map[idx] = value
+        self._dirty_tiles.add((row, col))
+        self._revision += 1
 
     def __len__(self):
         return len(self._map)
@@ -59,4 +68,16 @@ class TileMap:
 
     @property
     def map(self):
-        return self._map
\ No newline at end of file
+        return self._map
+
+    @property
+    def max_value(self):
+        return self._max_value
+
+    @property
+    def dirty_tiles(self):
+        return self._dirty_tiles
+
+    @property
+    def revision(self):
+        return self._revision
\ No newline at end of file
@@ -3,7 +3,7 @@
 import pyglet
 
 from src.tilemap import TileMap
-from src.renderer import VertexBufferedRenderer, GeomBufferedRenderer, NaiveInstantaneousRenderer, Pyglet_VertexBufferedRenderer
+from src.renderer import VertexBufferedRenderer, GeomBufferedRenderer, NaiveInstantaneousRenderer, Pyglet_VertexBufferedRenderer, get_default_renderer_cls
 
 from src.constants import WINDOW_MINIMUM_SIZE
 
@@ -21,7 +21,9 @@ class Window(pyglet.window.Window):
 
         self._renderer = None
         self._renderers_cls_list = [Pyglet_VertexBufferedRenderer, GeomBufferedRenderer, VertexBufferedRenderer, NaiveInstantaneousRenderer ]
-        self.set_renderer(self._renderers_cls_list[0])
+        # Only cycle through the renderers which can run on the current OpenGL context.
+        self._renderers_cls_list = [cls for cls in self._renderers_cls_list if cls.is_supported()]
+        self.set_renderer(get_default_renderer_cls())
 
 
     def _init_gl(self):